@@ -0,0 +1,79 @@
+from typing import Callable, Dict, List, Optional, Tuple
+import os
+
+
+# Backends from fastest to slowest. 'python' is the reference code and is always available,
+# every other backend is cross-checked against it before it is used.
+PREFERENCE: List[str] = ['hashlib', 'gmpy2', 'python']
+
+# Set to a backend name to force it wherever it is available, e.g. 'python' for the reference code.
+ENV_VAR: str = 'CRYPTOPI_BACKEND'
+FORCED: Optional[str] = os.environ.get(ENV_VAR) or None
+
+REGISTRY: Dict[str, Dict[str, Callable]] = {}
+SAMPLES: Dict[str, List[tuple]] = {}
+CHECKED: Dict[Tuple[str, str], bool] = {}
+ACTIVE: Dict[str, Callable] = {}
+
+
+# Add implementation 'name' of operation 'op'. The reference registration also supplies
+# 'samples', argument tuples the other backends must agree on.
+def register(op: str, name: str, fn: Callable, samples: Optional[List[tuple]] = None) -> None:
+    REGISTRY.setdefault(op, {})[name] = fn
+    if samples is not None:
+        SAMPLES[op] = samples
+    select(op)
+
+
+def crossCheck(op: str, name: str) -> bool:
+    if name == 'python':
+        return True
+
+    if (op, name) not in CHECKED:
+        reference: Callable = REGISTRY[op]['python']
+        fn: Callable = REGISTRY[op][name]
+        try:
+            CHECKED[op, name] = all(fn(*args) == reference(*args) for args in SAMPLES.get(op, []))
+        except Exception:
+            CHECKED[op, name] = False
+    return CHECKED[op, name]
+
+
+# Point 'op' at the forced backend if set, otherwise the most preferred one that passes its cross-check.
+def select(op: str) -> None:
+    candidates: List[str] = ([FORCED] if FORCED else PREFERENCE) + ['python']
+    for name in candidates:
+        if name in REGISTRY[op] and crossCheck(op, name):
+            ACTIVE[op] = REGISTRY[op][name]
+            return
+
+
+# Force backend 'name' for every operation that has it, None restores automatic selection.
+def use(name: Optional[str]) -> None:
+    global FORCED
+    FORCED = name
+    for op in REGISTRY:
+        select(op)
+
+
+def get(op: str) -> Callable:
+    return ACTIVE[op]
+
+
+# Name of the backend currently serving 'op'.
+def active(op: str) -> str:
+    for name, fn in REGISTRY[op].items():
+        if fn is ACTIVE[op]:
+            return name
+    return 'python'
+
+
+# Cross-check every registered backend of every operation against the reference.
+def selfTest() -> Dict[str, Dict[str, bool]]:
+    CHECKED.clear()
+    results: Dict[str, Dict[str, bool]] = {
+        op: {name: crossCheck(op, name) for name in backends} for op, backends in REGISTRY.items()
+    }
+    for op in REGISTRY:
+        select(op)
+    return results
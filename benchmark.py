@@ -0,0 +1,311 @@
+from sha1 import sha1, hmac1, Hmac1
+from sha256 import sha256, hmac256, Hmac256, sha256Many
+from sha512 import sha512, hmac512, Hmac512, sha512Many
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from argparse import ArgumentParser
+from time import perf_counter
+from statistics import median
+import platform
+import random
+import secp256k1
+import backend
+import ed25519
+import json
+import sys
+import os
+
+
+# Message sizes for the hash throughput runs, tiny to tens of MB.
+SIZES: List[int] = [16, 64, 1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024]
+
+# Term counts for the multi-scalar runs, the largest take minutes so '--max-terms' caps them.
+TERMS: List[int] = [2, 10, 100, 1000, 10000, 100000]
+
+# Fraction of a scalar's bits set in each Hamming-weight class of the timing run.
+WEIGHTS: List[float] = [1 / 16, 1 / 4, 1 / 2, 3 / 4, 15 / 16]
+
+# Backend operations each result may reach, looked up by the name before any '/', then
+# before the first '.'. Names missing here count as reaching every operation.
+BACKEND_OPS: Dict[str, Tuple[str, ...]] = {
+    'sha1': ('sha1',), 'hmac1': ('sha1',), 'Hmac1': ('sha1',),
+    'sha256': ('sha256',), 'hmac256': ('sha256',), 'Hmac256': ('sha256',), 'sha256Many': (),
+    'sha512': ('sha512',), 'hmac512': ('sha512',), 'Hmac512': ('sha512',), 'sha512Many': (),
+    'secp256k1.mod': (), 'secp256k1.fieldReduce': (), 'ed25519.mod': (), 'ed25519.fieldReduce': (),
+    'secp256k1': ('invert', 'sha256', 'secp256k1.multiply'),
+    'ed25519': ('invert', 'sha512', 'ed25519.multiply')
+}
+
+# Exit status when nothing regressed but some results were skipped for a backend change,
+# distinct from 1 for a regression and 2 for a usage error.
+SKIPPED: int = 3
+
+
+# Call 'fn' until 'minTime' seconds have passed, return the best calls per second of 'repeat' rounds.
+def rate(fn: Callable[[], object], minTime: float, repeat: int = 3) -> float:
+    best: float = 0.0
+    for _ in range(repeat):
+        calls: int = 0
+        start: float = perf_counter()
+        elapsed: float = 0.0
+        while elapsed < minTime or calls == 0:
+            fn()
+            calls += 1
+            elapsed = perf_counter() - start
+        best = max(best, calls / elapsed)
+    return best
+
+
+def benchHashes(sizes: List[int], minTime: float) -> Dict[str, Dict]:
+    results: Dict[str, Dict] = {}
+    for name, fn in (('sha1', sha1), ('sha256', sha256), ('sha512', sha512)):
+        for size in sizes:
+            message: bytes = os.urandom(size)
+            results[f'{name}/{size}'] = {'unit': 'MB/s', 'value': rate(lambda: fn(message), minTime) * size / 1e6}
+    return results
+
+
+# Many short messages in one call, as when hashing Merkle nodes.
+def benchMany(count: int, minTime: float) -> Dict[str, Dict]:
+    messages: List[bytes] = [os.urandom(64) for _ in range(count)]
+
+    results: Dict[str, Dict] = {}
+    for name, fn in (('sha256Many', sha256Many), ('sha512Many', sha512Many)):
+        results[f'{name}/{count}x64'] = {'unit': 'msg/s', 'value': rate(lambda: fn(messages), minTime) * count}
+    return results
+
+
+def benchHmacs(minTime: float) -> Dict[str, Dict]:
+    key: bytes = os.urandom(32)
+    message: bytes = os.urandom(64)
+
+    results: Dict[str, Dict] = {}
+    for name, fn in (('hmac1', hmac1), ('hmac256', hmac256), ('hmac512', hmac512)):
+        results[name] = {'unit': 'ops/s', 'value': rate(lambda: fn(key, message), minTime)}
+
+    # Reuse one keyed object per key, as long-lived keys would.
+    for name, cls in (('Hmac1', Hmac1), ('Hmac256', Hmac256), ('Hmac512', Hmac512)):
+        keyed = cls(key)
+
+        def mac() -> bytes:
+            h = keyed.copy()
+            h.update(message)
+            return h.digest()
+
+        results[f'{name}.copy'] = {'unit': 'ops/s', 'value': rate(mac, minTime)}
+    return results
+
+
+# Reduction of a full field product, generic '%' against each curve's 'fieldReduce'.
+def benchFields(minTime: float) -> Dict[str, Dict]:
+    results: Dict[str, Dict] = {}
+    for curve in (secp256k1, ed25519):
+        P: int = curve.P
+        a: int = int.from_bytes(os.urandom(32), 'big') % P * (int.from_bytes(os.urandom(32), 'big') % P)
+        results[f'{curve.__name__}.mod'] = {'unit': 'ops/s', 'value': rate(lambda: a % P, minTime)}
+        results[f'{curve.__name__}.fieldReduce'] = {'unit': 'ops/s', 'value': rate(lambda: curve.fieldReduce(a), minTime)}
+    return results
+
+
+def benchSecp256k1(minTime: float) -> Dict[str, Dict]:
+    sk: bytes = os.urandom(32)
+    msg: bytes = os.urandom(32)
+    entropy: bytes = os.urandom(32)
+    pk: bytes = secp256k1.getPublicKey(sk, True)
+    sig: bytes = secp256k1.sign(msg, sk, entropy)
+    msgs: List[bytes] = [os.urandom(32) for _ in range(64)]
+    # One key that is off the curve, every item still gets its own result.
+    batch: List[tuple] = [(sig, msg, pk)] * 63 + [(sig, msg, b'\x02' + (5).to_bytes(32, 'big'))]
+    recid: int = secp256k1.sign(msg, sk, entropy, True)[64]
+    recoverable: List[tuple] = [(s[:64], s[64], m) for s, m in zip(secp256k1.signMany(msgs, sk, None, True), msgs)]
+
+    return {
+        'secp256k1.getPublicKey': {'unit': 'ops/s', 'value': rate(lambda: secp256k1.getPublicKey(sk, True), minTime)},
+        'secp256k1.sign': {'unit': 'ops/s', 'value': rate(lambda: secp256k1.sign(msg, sk, entropy), minTime)},
+        'secp256k1.verify': {'unit': 'ops/s', 'value': rate(lambda: secp256k1.verify(sig, msg, pk), minTime)},
+        'secp256k1.signMany/64': {'unit': 'sig/s', 'value': rate(lambda: secp256k1.signMany(msgs, sk), minTime) * 64},
+        'secp256k1.verifyBatch/64': {'unit': 'sig/s', 'value': rate(lambda: list(secp256k1.verifyBatch(batch, 16, 1)), minTime) * 64},
+        'secp256k1.recover': {'unit': 'ops/s', 'value': rate(lambda: secp256k1.recover(sig, recid, msg), minTime)},
+        'secp256k1.recoverMany/64': {'unit': 'sig/s', 'value': rate(lambda: secp256k1.recoverMany(recoverable), minTime) * 64}
+    }
+
+
+def benchEd25519(minTime: float) -> Dict[str, Dict]:
+    sk: bytes = os.urandom(32)
+    msg: bytes = os.urandom(32)
+    pk: bytes = ed25519.getPublicKey(sk)
+    sig: bytes = ed25519.sign(msg, pk)
+
+    results: Dict[str, Dict] = {
+        'ed25519.getPublicKey': {'unit': 'ops/s', 'value': rate(lambda: ed25519.getPublicKey(sk), minTime)},
+        'ed25519.sign': {'unit': 'ops/s', 'value': rate(lambda: ed25519.sign(msg, pk), minTime)},
+        'ed25519.verify': {'unit': 'ops/s', 'value': rate(lambda: ed25519.verify(sig, msg, pk), minTime)}
+    }
+
+    # Batch throughput is reported per signature so it compares directly with 'verify'.
+    items: List[tuple] = [(sig, msg, pk)] * 64
+    results['ed25519.batchVerify/64'] = {
+        'unit': 'sig/s', 'value': rate(lambda: ed25519.batchVerify(items), minTime) * len(items)
+    }
+    return results
+
+
+# Sum of n random multiples, reported per term. Points are drawn from the base tables,
+# which are already affine, so no time goes into building them.
+def benchMultiScalar(counts: List[int], minTime: float) -> Dict[str, Dict]:
+    results: Dict[str, Dict] = {}
+    for curve in (secp256k1, ed25519):
+        points: List = [Q for row in curve.baseTable() for Q in row]
+        for count in counts:
+            terms: List[tuple] = [
+                (points[i % len(points)], int.from_bytes(os.urandom(32), 'big') % curve.N) for i in range(count)
+            ]
+            results[f'{curve.__name__}.multiplySum/{count}'] = {
+                'unit': 'terms/s', 'value': rate(lambda: curve.multiplySum(terms), minTime) * count
+            }
+    return results
+
+
+# Random scalar below 'order' with exactly 'weight' bits set.
+def weightedScalar(order: int, weight: int) -> int:
+    k: int = 0
+    for i in random.sample(range(order.bit_length() - 1), weight):
+        k |= 1 << i
+    return k
+
+
+# Median time of every secret multiply mode per Hamming-weight class of the scalar, and
+# the spread of those medians relative to their mean. Key-dependent timing shows up as
+# a spread well above the run-to-run noise.
+def benchTiming(samples: int) -> Dict[str, Dict]:
+    results: Dict[str, Dict] = {}
+    for curve in (secp256k1, ed25519):
+        for mode, fn in curve.SECRET_MODES.items():
+            # Classes take turns so drift in machine load hits them all alike.
+            weights: List[int] = [round(fraction * (curve.N.bit_length() - 1)) for fraction in WEIGHTS]
+            times: Dict[int, List[float]] = {weight: [] for weight in weights}
+            for _ in range(samples):
+                for weight in weights:
+                    k: int = weightedScalar(curve.N, weight)
+                    start: float = perf_counter()
+                    fn(k)
+                    times[weight].append((perf_counter() - start) * 1e6)
+            classes: Dict[int, float] = {weight: median(times[weight]) for weight in weights}
+
+            average: float = sum(classes.values()) / len(classes)
+            results[f'{curve.__name__}.{mode}'] = {
+                'unit': 'us', 'classes': classes, 'spread': (max(classes.values()) - min(classes.values())) / average
+            }
+    return results
+
+
+def run(sizes: List[int], minTime: float, counts: List[int] = TERMS[:4]) -> Dict:
+    # Build the fixed-base tables up front so they are not charged to the first run.
+    secp256k1.baseTable()
+    ed25519.baseTable()
+
+    results: Dict[str, Dict] = {}
+    results.update(benchHashes(sizes, minTime))
+    results.update(benchMany(4096, minTime))
+    results.update(benchHmacs(minTime))
+    results.update(benchFields(minTime))
+    results.update(benchSecp256k1(minTime))
+    results.update(benchEd25519(minTime))
+    results.update(benchMultiScalar(counts, minTime))
+
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'backends': {op: backend.active(op) for op in sorted(backend.REGISTRY)},
+        'results': results
+    }
+
+
+# Operations served by a different backend than in 'baseline', which then times other code.
+# Baselines from before backends were recorded count as differing everywhere.
+def backendChanges(current: Dict, baseline: Dict) -> Dict[str, str]:
+    old: Dict[str, str] = baseline.get('backends', {})
+    return {
+        op: f'{op}: {old.get(op, "unrecorded")} -> {name}'
+        for op, name in current['backends'].items() if old.get(op) != name
+    }
+
+
+def backendOps(name: str, allOps: List[str]) -> Tuple[str, ...]:
+    key: str = name.split('/')[0]
+    if key not in BACKEND_OPS:
+        key = key.split('.')[0]
+    return BACKEND_OPS.get(key, tuple(allOps))
+
+
+# Every benchmark is higher-is-better, flag those that dropped more than 'threshold' below the baseline.
+# Results reaching an operation in 'changed' time other code than the baseline did and are skipped.
+def compare(current: Dict, baseline: Dict, threshold: float, changed: Set[str]) -> Tuple[List[str], List[str]]:
+    regressions: List[str] = []
+    skipped: List[str] = []
+    for name, entry in baseline['results'].items():
+        if name not in current['results']:
+            continue
+        if changed.intersection(backendOps(name, list(current['backends']))):
+            skipped.append(name)
+            continue
+
+        old: float = entry['value']
+        new: float = current['results'][name]['value']
+        change: float = (new - old) / old
+        print(f'{name:28} {old:14.2f} -> {new:14.2f} {entry["unit"]:6} {change:+.1%}')
+        if change < -threshold:
+            regressions.append(name)
+
+    return regressions, skipped
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser: ArgumentParser = ArgumentParser(description='Benchmark the hash, HMAC and curve functions.')
+    parser.add_argument('--output', default='benchmark.json', help='Where to write the JSON results.')
+    parser.add_argument('--baseline', help='JSON results to compare against.')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Allowed fractional slowdown, 0.1 is 10%%.')
+    parser.add_argument('--max-size', type=int, default=SIZES[-1], help='Largest hashed message in bytes.')
+    parser.add_argument('--max-terms', type=int, default=1000, help='Largest multi-scalar sum, up to 100000.')
+    parser.add_argument('--timing', type=int, default=0, help='Keys per Hamming-weight class in the timing run, 0 skips it.')
+    parser.add_argument('--backend', help="Force a backend where available, e.g. 'python', see 'backend.use'.")
+    parser.add_argument('--min-time', type=float, default=0.2, help='Seconds spent on each round of a benchmark.')
+    args = parser.parse_args(argv)
+
+    if args.backend:
+        backend.use(args.backend)
+
+    sizes: List[int] = [size for size in SIZES if size <= args.max_size]
+    counts: List[int] = [count for count in TERMS if count <= args.max_terms]
+    current: Dict = run(sizes, args.min_time, counts)
+    if args.timing:
+        current['timing'] = benchTiming(args.timing)
+        for name, entry in current['timing'].items():
+            classes: str = ' '.join(f'{weight}:{time:.0f}' for weight, time in entry['classes'].items())
+            print(f'{name:28} spread {entry["spread"]:6.1%}  median us by weight {classes}')
+
+    with open(args.output, 'w') as f:
+        json.dump(current, f, indent=2)
+
+    if not args.baseline:
+        for name, entry in current['results'].items():
+            print(f'{name:28} {entry["value"]:14.2f} {entry["unit"]}')
+        return 0
+
+    with open(args.baseline) as f:
+        baseline: Dict = json.load(f)
+
+    changes: Dict[str, str] = backendChanges(current, baseline)
+    regressions, skipped = compare(current, baseline, args.threshold, set(changes))
+    if regressions:
+        print('Regressed beyond threshold:', ', '.join(regressions))
+    if skipped:
+        print('Backends differ from the baseline:', ', '.join(changes.values()))
+        print('Not compared:', ', '.join(skipped))
+        print('Rerun with --backend or record a new baseline.')
+    if regressions:
+        return 1
+    return SKIPPED if skipped else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
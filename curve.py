@@ -1,13 +1,45 @@
 from util import numToBytes
-from typing import List
+from backend import register, get
+from operator import xor
+from typing import Any, Callable, Iterable, List, Optional, Tuple
 
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
 
+
+# Affine point, or the point at infinity when 'infinity' is set. '__slots__' keeps large
+# tables of points free of a per-instance '__dict__'.
 class Point():
-    def __init__(self, x: int, y: int) -> None:
+    __slots__ = ('x', 'y', 'infinity')
+
+    def __init__(self, x: int, y: int, infinity: bool = False) -> None:
         self.x = x
         self.y = y
+        self.infinity = infinity
+
+    # The point at infinity, x and y are 0 but only 'infinity' is meaningful.
+    @classmethod
+    def atInfinity(cls) -> 'Point':
+        return cls(0, 0, True)
+
+    # Build finite points from (x, y) pairs without running '__init__' once per point.
+    @classmethod
+    def many(cls, coords: Iterable[Tuple[int, int]]) -> List['Point']:
+        new: Callable = object.__new__
+        points: List[Point] = []
+        for x, y in coords:
+            Q: Point = new(cls)
+            Q.x = x
+            Q.y = y
+            Q.infinity = False
+            points.append(Q)
+        return points
 
     def toArray(self, isCompressed: bool = True) -> List[int]:
+        if self.infinity:
+            return [0]
         if isCompressed:
             header: int = 3 if self.y & 1 else 2
             return [header] + numToBytes(self.x)
@@ -17,21 +49,271 @@ class Point():
     def set(self, x: int, y: int) -> None:
         self.x = x
         self.y = y
+        self.infinity = False
 
     def clear(self) -> None:
         self.x = 0
         self.y = 0
+        self.infinity = True
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Point):
+            return False
+        if self.infinity or other.infinity:
+            return self.infinity == other.infinity
+        return self.x == other.x and self.y == other.y
+
+    # Matches '__eq__', every point at infinity hashes alike whatever its x and y.
+    def __hash__(self) -> int:
+        if self.infinity:
+            return hash((0, 0, True))
+        return hash((self.x, self.y, False))
 
     def __repr__(self) -> str:
+        if self.infinity:
+            return 'Point at infinity'
         return f'x: {self.x}\ny: {self.y}'
 
 
+# Python's '%' already lands in [0, modulo) for negative 'a'.
 def mod(a: int, modulo: int) -> int:
-    if a < 0:
-        return a - modulo
     return a % modulo
 
 
+# Width-'width' non-adjacent form of 'k', least significant digit first. Nonzero digits
+# are odd, lie strictly between -2^(width - 1) and 2^(width - 1), and are followed by
+# at least 'width - 1' zeros.
+def wnaf(k: int, width: int) -> List[int]:
+    full: int = 1 << width
+    half: int = full >> 1
+
+    digits: List[int] = []
+    while k:
+        d: int = 0
+        if k & 1:
+            d = k & (full - 1)
+            if d >= half: d -= full
+            k -= d
+        digits.append(d)
+        k >>= 1
+    return digits
+
+
 # Compute the greatest common divisor of ints 'a' and 'modulo'.
+def invertPython(a: int, modulo: int) -> int:
+    return pow(a, modulo - 2, modulo)
+
+
+def invertGmpy2(a: int, modulo: int) -> int:
+    return int(gmpy2.invert(a, modulo)) if a % modulo else 0
+
+
+# Dispatch to the fastest backend that agrees with 'invertPython', see 'backend'.
 def invert(a: int, modulo: int) -> int:
-    return pow(a, modulo - 2, modulo)
\ No newline at end of file
+    return get('invert')(a, modulo)
+
+
+register('invert', 'python', invertPython, [(3, 7), (-5, 13), (0, 11), (2 ** 255 - 20, 2 ** 255 - 19)])
+if gmpy2 is not None:
+    register('invert', 'gmpy2', invertGmpy2)
+
+
+# Invert every element of 'values' with a single 'invert' (Montgomery's trick): running
+# products are inverted once and unwound with 3(n - 1) multiplications. Elements that are
+# zero modulo 'modulo' have no inverse and come back as 0 without spoiling the others.
+def batchInvert(values: List[int], modulo: int) -> List[int]:
+    products: List[int] = []
+    acc: int = 1
+    for a in values:
+        products.append(acc)
+        if a % modulo:
+            acc = acc * a % modulo
+
+    inverses: List[int] = [0] * len(values)
+    acc = invert(acc, modulo)
+    for i in range(len(values) - 1, -1, -1):
+        a: int = values[i]
+        if a % modulo:
+            inverses[i] = acc * products[i] % modulo
+            acc = acc * a % modulo
+    return inverses
+
+
+# Terms up to which 'multiScalar' uses Straus' method, beyond it Pippenger's buckets win.
+STRAUSS_MAX: int = 64
+
+
+# The projective operations of a curve, so one multi-scalar routine serves both curves.
+class Group():
+    def __init__(
+        self, identity: Any, fromAffine: Callable, add: Callable, double: Callable, negate: Callable, order: int
+    ) -> None:
+        self.identity = identity
+        self.fromAffine: Callable[[Point], Any] = fromAffine
+        self.add: Callable[[Any, Any], Any] = add
+        self.double: Callable[[Any], Any] = double
+        self.negate: Callable[[Any], Any] = negate
+        self.order: int = order
+
+
+# Straus' method: the sum of k * Q over all '(Q, k)' in 'terms', sharing one chain of
+# doublings. Each scalar is read in width-'width' wNAF and its additions are sorted by bit.
+def strauss(group: Group, terms: Iterable[Tuple[Point, int]], width: int = 4) -> Any:
+    if width < 2:
+        raise ValueError('Straus needs a wNAF width of at least 2.')
+
+    add: Callable = group.add
+    columns: List[List[Any]] = []
+    for Q, k in terms:
+        A: Any = group.fromAffine(Q)
+        A2: Any = group.double(A)
+        T: List[Any] = [A]
+        for _ in range((1 << width - 2) - 1):
+            T.append(add(T[-1], A2))
+
+        for i, d in enumerate(wnaf(k % group.order, width)):
+            if i == len(columns):
+                columns.append([])
+            if d > 0: columns[i].append(T[d >> 1])
+            elif d < 0: columns[i].append(group.negate(T[-d >> 1]))
+
+    S: Any = group.identity
+    for column in reversed(columns):
+        S = group.double(S)
+        for E in column:
+            S = add(S, E)
+    return S
+
+
+# Bucket window for 'n' terms of 'bits'-bit scalars: each of the bits / window rounds
+# costs n bucket additions and about 2^window to sum the 2^(window - 1) buckets.
+def pippengerWindow(n: int, bits: int) -> int:
+    return min(range(1, 21), key=lambda c: -(-bits // c) * (n + (1 << c)))
+
+
+# Pippenger's bucket method. Scalars are cut into signed 'window'-bit digits, every point
+# is added once per round into the bucket of its digit, and the buckets are summed with a
+# running total so bucket 'j' counts 'j' times.
+def pippenger(group: Group, terms: Iterable[Tuple[Point, int]], window: Optional[int] = None) -> Any:
+    add: Callable = group.add
+    points: List[Any] = []
+    scalars: List[int] = []
+    for Q, k in terms:
+        k %= group.order
+        if k:
+            points.append(group.fromAffine(Q))
+            scalars.append(k)
+    if not points:
+        return group.identity
+
+    c: int = window or pippengerWindow(len(points), group.order.bit_length())
+    if c < 1:
+        raise ValueError('Pippenger needs a bucket window of at least 1.')
+    full: int = 1 << c
+    half: int = full >> 1
+
+    # Signed digits in (-2^(c - 1), 2^(c - 1)] halve the buckets, negative ones add '-Q'.
+    digits: List[List[int]] = []
+    for k in scalars:
+        ds: List[int] = []
+        while k:
+            d: int = k & full - 1
+            if d > half: d -= full
+            ds.append(d)
+            k = k - d >> c
+        digits.append(ds)
+    negated: List[Any] = [group.negate(E) for E in points]
+
+    S: Any = group.identity
+    for i in range(max(map(len, digits)) - 1, -1, -1):
+        for _ in range(c):
+            S = group.double(S)
+
+        buckets: List[Any] = [None] * (half + 1)
+        for E, nE, ds in zip(points, negated, digits):
+            if i >= len(ds) or not ds[i]: continue
+            d: int = ds[i]
+            if d < 0: d, E = -d, nE
+            buckets[d] = E if buckets[d] is None else add(buckets[d], E)
+
+        running: Any = group.identity
+        total: Any = group.identity
+        for bucket in reversed(buckets[1:]):
+            if bucket is not None:
+                running = add(running, bucket)
+            total = add(total, running)
+        S = add(S, total)
+    return S
+
+
+# Sum of k * Q over all '(Q, k)' in 'terms', Straus for a few terms and Pippenger for many.
+# 'window' overrides the setting of whichever method is picked: up to 'STRAUSS_MAX' terms it
+# is the wNAF width (at least 2, default 4), beyond it the bucket bits (at least 1, default
+# from 'pippengerWindow').
+def multiScalar(group: Group, terms: Iterable[Tuple[Point, int]], window: Optional[int] = None) -> Any:
+    terms = list(terms)
+    if len(terms) <= STRAUSS_MAX:
+        return strauss(group, terms, window or 4)
+    return pippenger(group, terms, window)
+
+
+# Swap the tuples 'A' and 'B' when 'mask' is -1 and keep them when it is 0, by masking
+# their words rather than branching.
+def cswap(A: tuple, B: tuple, mask: int) -> Tuple[tuple, tuple]:
+    t: List[int] = [(a ^ b) & mask for a, b in zip(A, B)]
+    return tuple(map(xor, A, t)), tuple(map(xor, B, t))
+
+
+# 'k' plus N or 2N, whichever sets bit 'order.bit_length()', so every scalar below
+# 'order' takes the same number of ladder steps and the same multiple of any point.
+def ladderScalar(k: int, order: int) -> int:
+    k = k % order + order
+    return k + order * (1 - (k >> order.bit_length()))
+
+
+# Montgomery ladder for k * A with the top bit of 'k' at 'bits - 1'. Every lower bit
+# costs one addition and one doubling, with R1 - R0 = A throughout, and the pair is
+# swapped by 'cswap' so no branch depends on 'k'. CPython's big ints still take
+# value-dependent time per operation, this fixes the sequence of operations only.
+def ladder(group: Group, A: Any, k: int, bits: int) -> Any:
+    R0: Any = A
+    R1: Any = group.double(A)
+    swap: int = 0
+    for i in range(bits - 2, -1, -1):
+        b: int = k >> i & 1
+        R0, R1 = cswap(R0, R1, -(swap ^ b))
+        swap = b
+        R1 = group.add(R0, R1)
+        R0 = group.double(R0)
+    R0, R1 = cswap(R0, R1, -swap)
+    return R0
+
+
+# Write a table of affine points to 'path' as rows of 32-byte big-endian (x, y) pairs.
+def saveTable(table: List[List[Point]], path: str) -> None:
+    with open(path, 'wb') as f:
+        f.write(len(table).to_bytes(2, 'big') + len(table[0]).to_bytes(2, 'big'))
+        for row in table:
+            for Q in row:
+                f.write(Q.x.to_bytes(32, 'big') + Q.y.to_bytes(32, 'big'))
+
+
+# Read a table written by 'saveTable'.
+def loadTable(path: str) -> List[List[Point]]:
+    with open(path, 'rb') as f:
+        data: bytes = f.read()
+
+    if len(data) < 4:
+        raise ValueError('Truncated point table.')
+    rows: int = int.from_bytes(data[0:2], 'big')
+    cols: int = int.from_bytes(data[2:4], 'big')
+    if len(data) != 4 + rows * cols * 64:
+        raise ValueError('Truncated point table.')
+    if rows == 0 or cols == 0:
+        raise ValueError('Empty point table.')
+
+    fromBytes: Callable = int.from_bytes
+    xs: List[int] = [fromBytes(data[i: i + 32], 'big') for i in range(4, len(data), 64)]
+    ys: List[int] = [fromBytes(data[i: i + 32], 'big') for i in range(36, len(data), 64)]
+    points: List[Point] = Point.many(zip(xs, ys))
+    return [points[i: i + cols] for i in range(0, len(points), cols)]
@@ -1,8 +1,14 @@
-from util import numToBytes, bytesToNum
-from curve import Point, invert, mod
-from sha512 import sha512, hmac512
-from random import randint
-from typing import List
+from util import Buffer, isBuffer, bytesToNum
+from backend import register, get
+from curve import Point, Group, invert, batchInvert, mod, wnaf, multiScalar, ladder, ladderScalar, saveTable, loadTable
+from sha512 import sha512
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+import os
+
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
 
 
 A: int = -1
@@ -10,30 +16,254 @@ P: int = 2 ** 255 - 19
 N: int = 2 ** 252 + 27742317777372353535851937790883648493
 D: int = mod(-121665 * invert(121666, P), P)
 
+# P = 2^255 - 19, so the bits above 2^255 fold back in multiplied by 19.
+FIELD_MASK: int = (1 << 255) - 1
+FIELD_FOLD: int = 19
+
 # Starting Point 'G'.
 G: Point = Point(
     15112221349535400772501151409588531511454012693041857206046113283949847762202,
     46316835694926478169428394003475163141307993866256225615783033603165251855960
 )
 
+# Extended coordinates (X, Y, Z, T) stand for the affine point (X / Z, Y / Z), with T = XY / Z.
+Extended = Tuple[int, int, int, int]
+IDENTITY: Extended = (0, 1, 1, 0)
+D2: int = 2 * D % P
+
+# Square root of -1, used when decompressing points.
+SQRT_M1: int = pow(2, (P - 1) // 4, P)
+
+# Default window for the wNAF ladder in 'multiply'.
+WNAF_WIDTH: int = 4
+
+# Precomputed multiples of 'G', built on first use by 'baseTable'.
+BASE_WINDOW: int = 4
+BASE_TABLE: Optional[List[List[Point]]] = None
+
+
+# Same folding reduction as 'secp256k1.fieldReduce', for 0 <= a < P² and 2^255 = 19 mod P.
+def fieldReduce(a: int) -> int:
+    a = (a >> 255) * FIELD_FOLD + (a & FIELD_MASK)
+    a = (a >> 255) * FIELD_FOLD + (a & FIELD_MASK)
+    return a - P if a >= P else a
 
+
+# Every product is reduced before the next one so no intermediate grows past P².
 def unsafeAdd(Q: Point, R: Point) -> None:
     x1: int = Q.x
+    y1: int = Q.y
     x2: int = R.x
+    y2: int = R.y
 
-    Q.x = mod(mod(x1 * R.y + Q.y * x2, P) * invert(1 + D * x1 * x2 * Q.y * R.y, P), P)
-    Q.y = mod(mod(Q.y * R.y - A * x1 * x2, P) * invert(1 - D * x1 * x2 * Q.y * R.y, P), P)
+    t: int = D * (x1 * x2 % P) % P * (y1 * y2 % P) % P
+    Q.x = (x1 * y2 + y1 * x2) % P * invert((1 + t) % P, P) % P
+    Q.y = (y1 * y2 - A * x1 * x2) % P * invert((1 - t) % P, P) % P
 
 
+# The Edwards addition law is complete: doubling and the identity (0, 1) need no special case.
 def add(Q: Point, R: Point) -> None:
-    if Q.x == R.x and Q.y == -R.y: Q.clear()
-    elif Q.x == 0 or Q.y == 0: Q.set(R.x, R.y)
-    elif R.x != 0 and R.y != 0: unsafeAdd(Q, R)
+    unsafeAdd(Q, R)
+
+
+def toExtended(Q: Point) -> Extended:
+    return (Q.x, Q.y, 1, Q.x * Q.y % P)
+
+
+# Convert back to affine coordinates, this is the only inversion needed.
+def fromExtended(E: Extended) -> Point:
+    X, Y, Z, _ = E
+    z: int = invert(Z, P)
+    return Point(X * z % P, Y * z % P)
+
+
+# Convert many points back to affine coordinates with one shared inversion, see 'batchInvert'.
+def fromExtendedMany(Es: List[Extended]) -> List[Point]:
+    return Point.many((X * z % P, Y * z % P) for (X, Y, _, _), z in zip(Es, batchInvert([E[2] for E in Es], P)))
+
+
+# Add two points together without inverting, 'add-2008-hwcd-3' for a = -1.
+def extendedAdd(E1: Extended, E2: Extended) -> Extended:
+    X1, Y1, Z1, T1 = E1
+    X2, Y2, Z2, T2 = E2
+
+    A: int = (Y1 - X1) * (Y2 - X2) % P
+    B: int = (Y1 + X1) * (Y2 + X2) % P
+    C: int = T1 * D2 * T2 % P
+    F: int = 2 * Z1 * Z2 % P
+
+    e: int = B - A
+    f: int = F - C
+    g: int = F + C
+    h: int = B + A
+    return (e * f % P, g * h % P, f * g % P, e * h % P)
+
+
+# Add point to itself without inverting, 'dbl-2008-hwcd' for a = -1.
+def extendedDouble(E: Extended) -> Extended:
+    X1, Y1, Z1, _ = E
+
+    A: int = X1 * X1 % P
+    B: int = Y1 * Y1 % P
+    C: int = 2 * Z1 * Z1 % P
+
+    h: int = A + B
+    e: int = h - (X1 + Y1) ** 2 % P
+    g: int = A - B
+    f: int = C + g
+    return (e * f % P, g * h % P, f * g % P, e * h % P)
+
+
+def negate(E: Extended) -> Extended:
+    return (P - E[0], E[1], E[2], P - E[3])
+
+
+# The odd multiples Q, 3Q, 5Q, ... (2^(width - 1) - 1)Q.
+def oddMultiples(Q: Point, width: int) -> List[Extended]:
+    A: Extended = toExtended(Q)
+    A2: Extended = extendedDouble(A)
+
+    T: List[Extended] = [A]
+    for _ in range((1 << width - 2) - 1):
+        T.append(extendedAdd(T[-1], A2))
+    return T
+
+
+# Left-to-right wNAF ladder with one inversion at the end.
+def multiplyExtended(Q: Point, k: int, width: int = WNAF_WIDTH) -> Extended:
+    T: List[Extended] = oddMultiples(Q, width)
+
+    S: Extended = IDENTITY
+    for d in reversed(wnaf(k, width)):
+        S = extendedDouble(S)
+        if d > 0: S = extendedAdd(S, T[d >> 1])
+        elif d < 0: S = extendedAdd(S, negate(T[-d >> 1]))
+    return S
+
+
+def multiplyPython(Q: Point, k: int, width: int = WNAF_WIDTH) -> Point:
+    return fromExtended(multiplyExtended(Q, k, width))
+
+
+# Same ladder over gmpy2 integers, which multiply and reduce faster than Python's.
+def multiplyGmpy2(Q: Point, k: int, width: int = WNAF_WIDTH) -> Point:
+    R: Point = multiplyPython(Point(gmpy2.mpz(Q.x), gmpy2.mpz(Q.y)), k, width)
+    return Point(int(R.x), int(R.y))
+
+
+# Dispatch to the fastest backend that agrees with 'multiplyPython', see 'backend'.
+def multiply(Q: Point, k: int, width: int = WNAF_WIDTH) -> Point:
+    return get('ed25519.multiply')(Q, k, width)
+
+
+register('ed25519.multiply', 'python', multiplyPython, [(G, 0), (G, 1), (G, N - 1), (G, 2 ** 200 + 12345)])
+if gmpy2 is not None:
+    register('ed25519.multiply', 'gmpy2', multiplyGmpy2)
+
+
+GROUP: Group = Group(IDENTITY, toExtended, extendedAdd, extendedDouble, negate, N)
+
+
+# Sum of k * Q over all '(Q, k)' in 'terms', see 'curve.multiScalar'.
+def multiplySumExtended(terms: Iterable[Tuple[Point, int]], window: Optional[int] = None) -> Extended:
+    return multiScalar(GROUP, terms, window)
+
+
+def multiplySum(terms: Iterable[Tuple[Point, int]], window: Optional[int] = None) -> Point:
+    return fromExtended(multiplySumExtended(terms, window))
+
+
+# Row 'i' holds the affine points j * 2^(window * i) * Q for j = 1 .. 2^window - 1.
+# The whole table is built in extended coordinates and normalized with one inversion.
+def precompute(Q: Point, window: int = BASE_WINDOW) -> List[List[Point]]:
+    cols: int = (1 << window) - 1
+    Es: List[Extended] = []
+    B: Extended = toExtended(Q)
+    for _ in range(-(-N.bit_length() // window)):
+        S: Extended = B
+        for _ in range(cols):
+            Es.append(S)
+            S = extendedAdd(S, B)
+
+        for _ in range(window):
+            B = extendedDouble(B)
+
+    points: List[Point] = fromExtendedMany(Es)
+    return [points[i: i + cols] for i in range(0, len(points), cols)]
+
+
+def baseTable() -> List[List[Point]]:
+    global BASE_TABLE
+    if BASE_TABLE is None:
+        BASE_TABLE = precompute(G, BASE_WINDOW)
+    return BASE_TABLE
+
+
+# Save the table of 'G' so other processes can skip building it.
+def saveBaseTable(path: str) -> None:
+    saveTable(baseTable(), path)
 
 
-def multiply(Q: Point, k: int) -> Point:
+# Check that 'table' is what 'precompute(G, window)' builds and return its window. Starting
+# from 'G', every entry must be the previous one plus the first of its row, and every row
+# must start 2^window times further along. The sums stay extended and are compared without inverting.
+def checkBaseTable(table: List[List[Point]]) -> int:
+    cols: int = len(table[0]) if table else 0
+    window: int = (cols + 1).bit_length() - 1
+    if cols == 0 or cols + 1 != 1 << window or len(table) != -(-N.bit_length() // window):
+        raise ValueError('Table has the wrong shape.')
+
+    B: Extended = toExtended(G)
+    for row in table:
+        if len(row) != cols:
+            raise ValueError('Table has the wrong shape.')
+
+        S: Extended = B
+        for T in row:
+            X, Y, Z, _ = S
+            if T.x >= P or T.y >= P or (X - T.x * Z) % P or (Y - T.y * Z) % P:
+                raise ValueError('Table was not built from G.')
+            S = extendedAdd(toExtended(T), toExtended(row[0]))
+
+        B = toExtended(row[0])
+        for _ in range(window):
+            B = extendedDouble(B)
+    return window
+
+
+def loadBaseTable(path: str) -> None:
+    global BASE_TABLE, BASE_WINDOW
+    table: List[List[Point]] = loadTable(path)
+    BASE_WINDOW = checkBaseTable(table)
+    BASE_TABLE = table
+
+
+# Multiply 'G' by 'k' using only table lookups and additions.
+def baseMultiplyExtended(k: int) -> Extended:
+    table: List[List[Point]] = baseTable()
+    mask: int = (1 << BASE_WINDOW) - 1
+    k %= N
+
+    S: Extended = IDENTITY
+    i: int = 0
+    while k:
+        j: int = k & mask
+        if j:
+            T: Point = table[i][j - 1]
+            S = extendedAdd(S, (T.x, T.y, 1, T.x * T.y % P))
+        k >>= BASE_WINDOW
+        i += 1
+    return S
+
+
+def baseMultiply(k: int) -> Point:
+    return fromExtended(baseMultiplyExtended(k))
+
+
+# Reference affine ladder, two inversions per addition.
+def multiplyAffine(Q: Point, k: int) -> Point:
     G: Point = Point(Q.x, Q.y)
-    S: Point = Point(0, 0)
+    S: Point = Point(0, 1)
     while k:
         if k & 1: add(S, G)
         add(G, G)           # Double
@@ -41,17 +271,158 @@ def multiply(Q: Point, k: int) -> Point:
     return S
 
 
-# Calculate public key from secret key.
-def getPublicKey(sk: List[int]) -> List[int]:
-    head: List[int] = sha512(sk)[:32]
+# Fixed-sequence multiply for secret scalars, see 'curve.ladder'. The addition law is
+# complete, so the random projective scale (λx, λy, λ, λt) is only there to mask values.
+def ladderMultiplyExtended(Q: Point, k: int) -> Extended:
+    l: int = int.from_bytes(os.urandom(32), 'big') % (P - 1) + 1
+    A: Extended = (Q.x * l % P, Q.y * l % P, l, Q.x * Q.y % P * l % P)
+    return ladder(GROUP, A, ladderScalar(k, N), N.bit_length() + 1)
+
+
+def ladderMultiply(Q: Point, k: int) -> Point:
+    return fromExtended(ladderMultiplyExtended(Q, k))
+
+
+def ladderBaseMultiply(k: int) -> Point:
+    return ladderMultiply(G, k)
+
+
+# How 'getPublicKey' and 'sign' multiply 'G' by secret scalars, as in 'secp256k1'.
+SECRET_MODES: Dict[str, Callable[[int], Point]] = {'table': baseMultiply, 'ladder': ladderBaseMultiply}
+SECRET_MULTIPLY: Callable[[int], Point] = baseMultiply
+
+
+def useSecretMode(name: str) -> None:
+    global SECRET_MULTIPLY
+    SECRET_MULTIPLY = SECRET_MODES[name]
+
+
+def isIdentity(E: Extended) -> bool:
+    X, Y, Z, _ = E
+    return X % P == 0 and (Y - Z) % P == 0
+
+
+# Multiply by the cofactor 8, dropping any small-order component.
+def clearCofactor(E: Extended) -> Extended:
+    return extendedDouble(extendedDouble(extendedDouble(E)))
+
+
+# 32 bytes little-endian 'y' with the low bit of 'x' in the top bit, RFC 8032 5.1.2.
+def encodePoint(Q: Point) -> bytes:
+    return (Q.y | (Q.x & 1) << 255).to_bytes(32, 'little')
+
+
+# Recover 'x' from 'y' and its sign bit, RFC 8032 5.1.3. None if 'data' encodes no point.
+def decodePoint(data: Union[List[int], Buffer]) -> Optional[Point]:
+    if len(data) != 32: return None
+    y: int = bytesToNum(bytes(data), 'le')
+    sign: int = y >> 255
+    y &= FIELD_MASK
+    if y >= P: return None
+
+    # x² = u / v, with the candidate root x = u v³ (u v⁷)^((P - 5) / 8).
+    u: int = (y * y - 1) % P
+    v: int = (D * y * y + 1) % P
+    x: int = u * pow(v, 3, P) * pow(u * pow(v, 7, P), (P - 5) // 8, P) % P
+    vxx: int = v * x * x % P
+    if vxx == (-u) % P:
+        x = x * SQRT_M1 % P
+    elif vxx != u:
+        return None
+
+    if x == 0 and sign: return None
+    if x & 1 != sign:
+        x = P - x
+    return Point(x, y)
+
+
+# Clamped secret scalar and nonce prefix from the 32-byte seed, RFC 8032 5.1.5.
+def expandKey(sk: Union[List[int], Buffer]) -> Tuple[int, bytes]:
+    h: bytes = sha512(bytes(sk[:32]))
+    head: bytearray = bytearray(h[:32])
     head[0] &= 248
     head[31] &= 127
     head[31] |= 64
-    secretKey: int = bytesToNum(head, 'le') % N
+    return bytesToNum(head, 'le'), h[32:]
+
+
+# Calculate public key from secret key, returned after the 32-byte seed as 'sk || pk'.
+def getPublicKey(sk: Union[List[int], Buffer]) -> Union[List[int], bytes]:
+    secretKey, _ = expandKey(sk)
 
     # Multiply Point 'G' by int 'secretKey' to find public key.
-    pk: Point = multiply(G, secretKey)
-    return sk + numToBytes(pk.y, 32, 'le')
+    pk: bytes = encodePoint(SECRET_MULTIPLY(secretKey))
+    if isBuffer(sk):
+        return bytes(sk[:32]) + pk
+    return list(sk[:32]) + list(pk)
+
+
+# Sign message with the 32-byte seed, or the 64-byte 'sk || pk' from 'getPublicKey' whose
+# 'pk' half is ignored, RFC 8032 5.1.6.
+def sign(msg: Union[List[int], Buffer], sk: Union[List[int], Buffer]) -> Union[List[int], bytes]:
+    message: bytes = bytes(msg)
+    secretKey, prefix = expandKey(sk)
+    # Always derive 'A' from the seed, a mismatched 'pk' half would reuse 'r' under a new
+    # challenge and the two signatures together give away 'secretKey'.
+    pk: bytes = encodePoint(SECRET_MULTIPLY(secretKey))
+
+    r: int = bytesToNum(sha512(prefix + message), 'le') % N
+    R: bytes = encodePoint(SECRET_MULTIPLY(r))
+    k: int = bytesToNum(sha512(R + pk + message), 'le') % N
+    s: int = (r + k * secretKey) % N
+
+    sig: bytes = R + s.to_bytes(32, 'little')
+    return sig if isBuffer(msg) else list(sig)
+
+
+# Split a signature into the points 'R', 'A' and scalars 's', 'k', or None if it is malformed.
+def parseSignature(
+    sig: Union[List[int], Buffer],
+    msg: Union[List[int], Buffer],
+    pk: Union[List[int], Buffer]
+) -> Optional[Tuple[Point, Point, int, int]]:
+    if len(sig) != 64: return None
+    encoded: bytes = bytes(pk[-32:])
+    R: Optional[Point] = decodePoint(sig[:32])
+    A: Optional[Point] = decodePoint(encoded)
+    s: int = bytesToNum(bytes(sig[32:]), 'le')
+    if R is None or A is None or s >= N: return None
+
+    k: int = bytesToNum(sha512(bytes(sig[:32]) + encoded + bytes(msg)), 'le') % N
+    return R, A, s, k
+
+
+# Verify signature with the 32-byte public key, or 'sk || pk'. Uses the cofactored
+# equation [8][s]G = [8]R + [8][k]A so single and batch verification always agree.
+def verify(sig: Union[List[int], Buffer], msg: Union[List[int], Buffer], pk: Union[List[int], Buffer]) -> bool:
+    parsed: Optional[Tuple[Point, Point, int, int]] = parseSignature(sig, msg, pk)
+    if parsed is None: return False
+    R, A, s, k = parsed
+
+    E: Extended = extendedAdd(baseMultiplyExtended(s), multiplyExtended(Point(P - A.x, A.y), k))
+    E = extendedAdd(E, negate(toExtended(R)))
+    return isIdentity(clearCofactor(E))
+
+
+# Verify all '(sig, msg, pk)' triples at once. With random 128-bit 'z', checks
+# [8]([-sum(z s)]G + sum([z]R) + sum([z k]A)) = 0 as one 'multiplySumExtended', so a single
+# forged signature fails the batch with overwhelming probability. False does not say which
+# one failed, 'verify' them one by one to find out.
+def batchVerify(items: Iterable[Tuple[Buffer, Buffer, Buffer]]) -> bool:
+    terms: List[Tuple[Point, int]] = []
+    total: int = 0
+    for sig, msg, pk in items:
+        parsed: Optional[Tuple[Point, Point, int, int]] = parseSignature(sig, msg, pk)
+        if parsed is None: return False
+        R, A, s, k = parsed
+
+        z: int = int.from_bytes(os.urandom(16), 'little')
+        total += z * s
+        terms.append((R, z))
+        terms.append((A, z * k))
+
+    E: Extended = extendedAdd(baseMultiplyExtended(-total), multiplySumExtended(terms))
+    return isIdentity(clearCofactor(E))
 
 
 if __name__ == '__main__':
@@ -66,3 +437,26 @@ if __name__ == '__main__':
     """
     pk: List[int] = getPublicKey(sk)
     print('Public key:', pk)
+
+    msg: List[int] = [104, 101, 108, 108, 111]
+    sig: List[int] = sign(msg, pk)
+    print('Signature:', sig)
+    print('Verified:', verify(sig, msg, pk))
+
+    # Compare the extended and affine ladders.
+    from timeit import timeit
+    k: int = bytesToNum(sk)
+    baseTable()
+    print('Fixed-base multiply:', timeit(lambda: baseMultiply(k), number=20) / 20)
+    for width in range(2, 7):
+        print(f'Extended wNAF multiply, width {width}:', timeit(lambda: multiply(G, k, width), number=20) / 20)
+    print('Affine multiply:', timeit(lambda: multiplyAffine(G, k), number=20) / 20)
+
+    # Per-signature cost of batch verification as the batch grows.
+    items: List[Tuple[bytes, bytes, bytes]] = []
+    for i in range(64):
+        kp: bytes = getPublicKey(os.urandom(32))
+        items.append((sign(bytes([i]), kp), bytes([i]), kp[32:]))
+    print('Verify:', timeit(lambda: verify(*items[0]), number=20) / 20)
+    for size in (4, 16, 64):
+        print(f'Batch verify, {size} signatures:', timeit(lambda: batchVerify(items[:size]), number=3) / 3 / size)
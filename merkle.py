@@ -0,0 +1,103 @@
+from util import Buffer
+from sha256 import sha256, sha256Many
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+
+# Leaves and inner nodes are hashed with different prefixes so one can't pass for the other.
+LEAF_PREFIX: bytes = b'\x00'
+NODE_PREFIX: bytes = b'\x01'
+
+
+def hashLeaf(data: Union[List[int], Buffer]) -> bytes:
+    return sha256(LEAF_PREFIX + bytes(data))
+
+
+def hashNode(left: bytes, right: bytes) -> bytes:
+    return sha256(NODE_PREFIX + left + right)
+
+
+# Binary sha256 Merkle tree with every level cached. Pairs are hashed left to right and the
+# last node of an odd level is carried up unchanged, so appending or replacing a leaf only
+# rehashes its path to the root.
+class MerkleTree():
+    def __init__(self, leaves: Iterable[Union[List[int], Buffer]] = ()) -> None:
+        self.levels: List[List[bytes]] = [[]]
+        self.extend(leaves)
+
+    def __len__(self) -> int:
+        return len(self.levels[0])
+
+    def append(self, data: Union[List[int], Buffer]) -> None:
+        self.levels[0].append(hashLeaf(data))
+        self.rebuild(len(self) - 1)
+
+    # Stream leaves in 'chunkSize' batches, hashing each level's changed nodes together.
+    def extend(self, leaves: Iterable[Union[List[int], Buffer]], chunkSize: int = 4096) -> None:
+        it: Iterator[Union[List[int], Buffer]] = iter(leaves)
+        while True:
+            chunk: List[bytes] = [LEAF_PREFIX + bytes(data) for data in islice(it, chunkSize)]
+            if not chunk:
+                break
+
+            start: int = len(self)
+            self.levels[0].extend(sha256Many(chunk))
+            self.rebuild(start)
+
+    # Replace leaf 'index' and rehash its O(log n) ancestors.
+    def update(self, index: int, data: Union[List[int], Buffer]) -> None:
+        if not 0 <= index < len(self):
+            raise IndexError('Leaf index out of range.')
+        self.levels[0][index] = hashLeaf(data)
+        self.rebuild(index, index)
+
+    # Recompute the parents of nodes 'start' .. 'end' on every level, or of 'start' onwards
+    # when 'end' is None, batching each level's pairs into one 'sha256Many' call.
+    def rebuild(self, start: int, end: Optional[int] = None) -> None:
+        level: int = 0
+        while len(self.levels[level]) > 1:
+            nodes: List[bytes] = self.levels[level]
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+
+            start //= 2
+            stop: int = (len(nodes) + 1) // 2 if end is None else end // 2 + 1
+            pairs: List[bytes] = [
+                NODE_PREFIX + nodes[2 * i] + nodes[2 * i + 1]
+                for i in range(start, stop) if 2 * i + 1 < len(nodes)
+            ]
+
+            # Pairs are hashed together, a lone last node is carried up.
+            hashed: Iterator[bytes] = iter(sha256Many(pairs))
+            self.levels[level + 1][start: stop] = [
+                next(hashed) if 2 * i + 1 < len(nodes) else nodes[2 * i]
+                for i in range(start, stop)
+            ]
+
+            if end is not None:
+                end //= 2
+            level += 1
+
+    def root(self) -> bytes:
+        if not self.levels[0]:
+            return sha256(b'')
+        return self.levels[-1][0]
+
+    # Sibling hashes from leaf 'index' up to the root, each flagged True when it sits on the left.
+    def proof(self, index: int) -> List[Tuple[bytes, bool]]:
+        if not 0 <= index < len(self):
+            raise IndexError('Leaf index out of range.')
+        path: List[Tuple[bytes, bool]] = []
+        for nodes in self.levels[:-1]:
+            sibling: int = index ^ 1
+            if sibling < len(nodes):
+                path.append((nodes[sibling], sibling < index))
+            index //= 2
+        return path
+
+
+def verifyProof(data: Union[List[int], Buffer], path: List[Tuple[bytes, bool]], root: bytes) -> bool:
+    node: bytes = hashLeaf(data)
+    for sibling, isLeft in path:
+        node = hashNode(sibling, node) if isLeft else hashNode(node, sibling)
+    return node == root
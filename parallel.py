@@ -0,0 +1,92 @@
+from sha1 import Sha1, sha1File
+from sha256 import Sha256, sha256File
+from sha512 import Sha512, sha512File
+from multiprocessing import Pool, cpu_count
+from typing import Callable, Dict, List, Optional, Union
+import os
+
+
+HASHES: Dict[str, type] = {'sha1': Sha1, 'sha256': Sha256, 'sha512': Sha512}
+FILE_HASHES: Dict[str, Callable[[str], bytes]] = {'sha1': sha1File, 'sha256': sha256File, 'sha512': sha512File}
+
+# Bytes read from disk at a time, so workers hold one piece of their chunk in memory.
+READ_SIZE: int = 1024 * 1024
+
+# Chunk digests and the root are hashed with different prefixes so one can't pass for the other.
+CHUNK_PREFIX: bytes = b'\x00'
+ROOT_PREFIX: bytes = b'\x01'
+
+
+# Hash 'size' bytes of 'path' starting at 'offset', after feeding 'prefix'.
+def hashRange(path: str, offset: int, size: int, algorithm: str, prefix: bytes = b'') -> bytes:
+    h: Union[Sha1, Sha256, Sha512] = HASHES[algorithm](prefix)
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while size > 0:
+            data: bytes = f.read(min(READ_SIZE, size))
+            if not data:
+                break
+            h.update(data)
+            size -= len(data)
+    return h.digest()
+
+
+def hashChunk(path: str, offset: int, size: int, algorithm: str) -> bytes:
+    return hashRange(path, offset, size, algorithm, CHUNK_PREFIX)
+
+
+def hashFile(path: str, algorithm: str = 'sha512') -> bytes:
+    return FILE_HASHES[algorithm](path)
+
+
+# Two-level tree hash of 'path': chunks of 'chunkSize' bytes are hashed across 'processes'
+# workers and the root hashes the chunk size followed by every chunk digest in order. The
+# result depends on 'chunkSize' and 'algorithm' but never on 'processes'.
+def treeHash(
+    path: str,
+    chunkSize: int = 16 * 1024 * 1024,
+    processes: Optional[int] = None,
+    algorithm: str = 'sha512'
+) -> bytes:
+    size: int = os.path.getsize(path)
+    tasks: List[tuple] = [(path, offset, chunkSize, algorithm) for offset in range(0, max(size, 1), chunkSize)]
+
+    processes = min(processes or cpu_count(), len(tasks))
+    if processes == 1:
+        digests: List[bytes] = [hashChunk(*task) for task in tasks]
+    else:
+        with Pool(processes) as pool:
+            digests: List[bytes] = pool.starmap(hashChunk, tasks)
+
+    root: Union[Sha1, Sha256, Sha512] = HASHES[algorithm](ROOT_PREFIX + chunkSize.to_bytes(8, 'big'))
+    for digest in digests:
+        root.update(digest)
+    return root.digest()
+
+
+# Plain digest of every file in 'paths', one file per task across 'processes' workers.
+def hashFiles(paths: List[str], processes: Optional[int] = None, algorithm: str = 'sha512') -> Dict[str, bytes]:
+    processes = min(processes or cpu_count(), max(len(paths), 1))
+    if processes == 1:
+        digests: List[bytes] = [hashFile(path, algorithm) for path in paths]
+    else:
+        with Pool(processes) as pool:
+            digests: List[bytes] = pool.starmap(hashFile, [(path, algorithm) for path in paths])
+    return dict(zip(paths, digests))
+
+
+if __name__ == '__main__':
+    from tempfile import NamedTemporaryFile
+    from time import perf_counter
+
+    # Time the tree hash of a 1 MiB file for every worker count up to the number of cores.
+    with NamedTemporaryFile(delete=False) as f:
+        f.write(os.urandom(1024 * 1024))
+
+    try:
+        for processes in range(1, cpu_count() + 1):
+            start: float = perf_counter()
+            root: bytes = treeHash(f.name, 128 * 1024, processes)
+            print(f'{processes} worker(s): {perf_counter() - start:.2f}s', root.hex()[:16])
+    finally:
+        os.remove(f.name)
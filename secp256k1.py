@@ -1,13 +1,28 @@
-from util import bytesToNum, numToBytes
-from curve import Point, invert, mod
-from sha256 import hmac256
-from random import randint
-from typing import List
+from util import Buffer, isBuffer, bytesToNum
+from backend import register, get
+from curve import Point, Group, invert, batchInvert, mod, wnaf, multiScalar, ladder, ladderScalar, saveTable, loadTable
+from sha256 import Hmac256, hmac256Key
+from multiprocessing import Pool, cpu_count
+from collections import OrderedDict, deque
+from itertools import islice
+from time import perf_counter
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+import hmac
+import os
+
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
 
 
 P: int = 2 ** 256 - 2 ** 32 - 2 ** 9 - 2 ** 8 - 2 ** 7 - 2 ** 6 - 2 ** 4 - 1
 N: int = 2 ** 256 - 432420386565659656852420866394968145599
 
+# P = 2^256 - FIELD_FOLD, so the bits above 2^256 fold back in multiplied by 'FIELD_FOLD'.
+FIELD_MASK: int = (1 << 256) - 1
+FIELD_FOLD: int = 2 ** 32 + 977
+
 # Starting Point 'G' for 'secp256k1'.
 # 02 79BE667E F9DCBBAC 55A06295 CE870B07 029BFCDB 2DCE28D9 59F2815B 16F81798
 G: Point = Point(
@@ -15,52 +30,365 @@ G: Point = Point(
     32670510020758816978083085130507043184471273380659243275938904335757337482424
 )
 
+# Jacobian coordinates (X, Y, Z) stand for the affine point (X / Z², Y / Z³).
+# Any triple with Z = 0 is the point at infinity.
+Jacobian = Tuple[int, int, int]
+INFINITY: Jacobian = (0, 1, 0)
+
+# Default window for the wNAF ladder in 'multiply'.
+WNAF_WIDTH: int = 4
+
+# Precomputed multiples of 'G', built on first use by 'baseTable'.
+BASE_WINDOW: int = 4
+BASE_TABLE: Optional[List[List[Point]]] = None
+
 
-def ArrToPoint(key: List[int]) -> Point:
+# The point with 'x' whose 'y' has parity 'odd', or None if 'x' is not on the curve.
+def liftX(x: int, odd: int) -> Optional[Point]:
+    if x >= P: return None
+    yy: int = (x * x * x + 7) % P
+    y: int = pow(yy, (P + 1) // 4, P)   # y = y² ^ (p + 1) / 4
+    if y * y % P != yy: return None
+
+    if (y & 1) != odd:
+        y = P - y
+    return Point(x, y)
+
+
+# Parse a serialized public key, raising ValueError if it is malformed or not on the curve.
+def ArrToPoint(key: Union[List[int], Buffer]) -> Point:
     # If 'key' is compressed, calculate 'y' from 'x'.
-    if len(key) == 32 or (key[0] == 2 or key[0] == 3):
-        assert 32 <= len(key) <= 33, 'Compressed key must be of length 32 or 33.'
-        x: int = bytesToNum(key[-32:])
-        y: int = pow(x ** 3 + 7, (P + 1) // 4, P)   # y = y² ^ (p + 1) / 4
-        return Point(x, y)
+    if len(key) == 32 or (len(key) == 33 and (key[0] == 2 or key[0] == 3)):
+        # Take the root matching the header's parity, keys without a header use the even root.
+        Q: Optional[Point] = liftX(bytesToNum(key[-32:]), key[0] & 1 if len(key) == 33 else 0)
+        if Q is None:
+            raise ValueError('Key is not a point on the curve.')
+        return Q
 
     # If 'key' is not compressed.
-    elif len(key) == 64 or (key[0] == 4):
-        assert 64 <= len(key) <= 65, 'Non-compressed key must be of length 64 or 65.'
-        x: int = bytesToNum(key[-64:-32])
-        y: int = bytesToNum(key[-32:])
-        return Point(x, y)
+    if not (len(key) == 64 or (len(key) == 65 and key[0] == 4)):
+        raise ValueError('Key must be of length 32, 33, 64 or 65.')
+    Q: Point = Point(bytesToNum(key[-64:-32]), bytesToNum(key[-32:]))
+    if not isOnCurve(Q):
+        raise ValueError('Key is not a point on the curve.')
+    return Q
+
+
+# True if 'Q' is a finite point with reduced coordinates on y² = x³ + 7.
+def isOnCurve(Q: Point) -> bool:
+    if Q.infinity or Q.x >= P or Q.y >= P:
+        return False
+    return (Q.y * Q.y - Q.x * Q.x * Q.x - 7) % P == 0
+
+
+# Reduce 0 <= a < P² with shifts and small multiplies instead of a long division. Two folds
+# bring 'a' below 2P. Slower than '%' in CPython, whose division is already native code, see
+# the 'benchmark' module, but it is the natural form for fixed-width backends.
+def fieldReduce(a: int) -> int:
+    a = (a >> 256) * FIELD_FOLD + (a & FIELD_MASK)
+    a = (a >> 256) * FIELD_FOLD + (a & FIELD_MASK)
+    return a - P if a >= P else a
 
 
 def unsafeAdd(Q: Point, R: Point) -> None:
     x1: int = Q.x
 
-    m: int = mod((R.y - Q.y) * invert(R.x - x1, P), P)
-    Q.x = mod(m ** 2 - x1 - R.x, P)
-    Q.y = mod(m * (x1 - Q.x) - Q.y, P)
+    m: int = (R.y - Q.y) * invert((R.x - x1) % P, P) % P
+    Q.x = (m * m - x1 - R.x) % P
+    Q.y = (m * (x1 - Q.x) - Q.y) % P
 
 
 # Add two points together.
 def add(Q: Point, R: Point) -> None:
-    if Q.x == R.x and Q.y == R.y: double(Q)
-    elif Q.x == R.x and Q.y == -R.y: Q.clear()
-    elif Q.x == 0 or Q.y == 0: Q.set(R.x, R.y)
-    elif R.x != 0 and R.y != 0: unsafeAdd(Q, R)
+    if R.infinity: return
+    if Q.infinity: Q.set(R.x, R.y)
+    elif Q.x != R.x: unsafeAdd(Q, R)
+    elif Q.y == R.y: double(Q)
+    else: Q.clear()
 
 
 # Add point to itself.
 def double(Q: Point) -> None:
+    if Q.infinity or Q.y == 0: return Q.clear()
     x1: int = Q.x
     y1: int = Q.y
 
-    m: int = mod(3 * x1 ** 2 * invert(2 * y1, P), P)
-    Q.x = mod(m ** 2 - x1 * 2, P)
-    Q.y = mod(m * (x1 - Q.x) - y1, P)
+    m: int = 3 * (x1 * x1 % P) * invert(2 * y1 % P, P) % P
+    Q.x = (m * m - x1 * 2) % P
+    Q.y = (m * (x1 - Q.x) - y1) % P
+
+
+def toJacobian(Q: Point) -> Jacobian:
+    if Q.infinity: return INFINITY
+    return (Q.x, Q.y, 1)
+
+
+# Convert back to affine coordinates, this is the only inversion needed.
+def fromJacobian(J: Jacobian) -> Point:
+    X, Y, Z = J
+    if Z == 0: return Point.atInfinity()
+
+    z: int = invert(Z, P)
+    zz: int = z * z % P
+    return Point(X * zz % P, Y * zz * z % P)
+
+
+# Convert many points back to affine coordinates with one shared inversion, see 'batchInvert'.
+def fromJacobianMany(Js: List[Jacobian]) -> List[Point]:
+    zs: List[int] = batchInvert([J[2] for J in Js], P)
+    zzs: List[int] = [z * z % P for z in zs]
+    points: List[Point] = Point.many((X * zz % P, Y * zz * z % P) for (X, Y, _), z, zz in zip(Js, zs, zzs))
+    for Q, J in zip(points, Js):
+        if J[2] == 0: Q.clear()
+    return points
+
+
+# Add point to itself without inverting, 'dbl-2009-l' for a = 0.
+def jacobianDouble(J: Jacobian) -> Jacobian:
+    X1, Y1, Z1 = J
+    if Z1 == 0 or Y1 == 0: return INFINITY
+
+    A: int = X1 * X1 % P
+    B: int = Y1 * Y1 % P
+    C: int = B * B % P
+    D: int = 2 * ((X1 + B) ** 2 - A - C) % P
+    E: int = 3 * A
+    F: int = E * E % P
+
+    X3: int = (F - 2 * D) % P
+    Y3: int = (E * (D - X3) - 8 * C) % P
+    Z3: int = 2 * Y1 * Z1 % P
+    return (X3, Y3, Z3)
+
+
+# Add two points together without inverting, 'add-1998-cmo-2'.
+def jacobianAdd(J1: Jacobian, J2: Jacobian) -> Jacobian:
+    X1, Y1, Z1 = J1
+    X2, Y2, Z2 = J2
+    if Z1 == 0: return J2
+    if Z2 == 0: return J1
+
+    Z1Z1: int = Z1 * Z1 % P
+    U2: int = X2 * Z1Z1 % P
+    S2: int = Y2 * Z1 * Z1Z1 % P
+
+    # Skip the 'J2' scaling when it is still affine (mixed addition).
+    if Z2 == 1:
+        U1: int = X1
+        S1: int = Y1
+    else:
+        Z2Z2: int = Z2 * Z2 % P
+        U1: int = X1 * Z2Z2 % P
+        S1: int = Y1 * Z2 * Z2Z2 % P
+
+    H: int = (U2 - U1) % P
+    r: int = (S2 - S1) % P
+    if H == 0:
+        return jacobianDouble(J1) if r == 0 else INFINITY
+
+    HH: int = H * H % P
+    HHH: int = H * HH % P
+    V: int = U1 * HH % P
+
+    X3: int = (r * r - HHH - 2 * V) % P
+    Y3: int = (r * (V - X3) - S1 * HHH) % P
+    Z3: int = Z1 * Z2 * H % P
+    return (X3, Y3, Z3)
+
+
+def negate(J: Jacobian) -> Jacobian:
+    return (J[0], P - J[1], J[2])
+
+
+# The odd multiples Q, 3Q, 5Q, ... (2^(width - 1) - 1)Q.
+def oddMultiples(Q: Point, width: int) -> List[Jacobian]:
+    A: Jacobian = toJacobian(Q)
+    A2: Jacobian = jacobianDouble(A)
+
+    T: List[Jacobian] = [A]
+    for _ in range((1 << width - 2) - 1):
+        T.append(jacobianAdd(T[-1], A2))
+    return T
+
+
+# Left-to-right wNAF ladder, at most one addition per 'width' bits of 'k'.
+def multiplyJacobian(Q: Point, k: int, width: int = WNAF_WIDTH) -> Jacobian:
+    if k == 0 or Q.infinity: return INFINITY
+    T: List[Jacobian] = oddMultiples(Q, width)
+
+    S: Jacobian = INFINITY
+    for d in reversed(wnaf(k, width)):
+        S = jacobianDouble(S)
+        if d > 0: S = jacobianAdd(S, T[d >> 1])
+        elif d < 0: S = jacobianAdd(S, negate(T[-d >> 1]))
+    return S
+
+
+def multiplyPython(Q: Point, k: int, width: int = WNAF_WIDTH) -> Point:
+    return fromJacobian(multiplyJacobian(Q, k, width))
+
+
+# Same ladder over gmpy2 integers, which multiply and reduce faster than Python's.
+def multiplyGmpy2(Q: Point, k: int, width: int = WNAF_WIDTH) -> Point:
+    R: Point = multiplyPython(Point(gmpy2.mpz(Q.x), gmpy2.mpz(Q.y), Q.infinity), k, width)
+    return Point(int(R.x), int(R.y), R.infinity)
+
+
+# Dispatch to the fastest backend that agrees with 'multiplyPython', see 'backend'.
+def multiply(Q: Point, k: int, width: int = WNAF_WIDTH) -> Point:
+    return get('secp256k1.multiply')(Q, k, width)
+
+
+register('secp256k1.multiply', 'python', multiplyPython, [(G, 0), (G, 1), (G, N - 1), (G, 2 ** 200 + 12345)])
+if gmpy2 is not None:
+    register('secp256k1.multiply', 'gmpy2', multiplyGmpy2)
+
+
+GROUP: Group = Group(INFINITY, toJacobian, jacobianAdd, jacobianDouble, negate, N)
+
+
+# Sum of k * Q over all '(Q, k)' in 'terms', see 'curve.multiScalar'.
+def multiplySumJacobian(terms: Iterable[Tuple[Point, int]], window: Optional[int] = None) -> Jacobian:
+    return multiScalar(GROUP, terms, window)
+
+
+def multiplySum(terms: Iterable[Tuple[Point, int]], window: Optional[int] = None) -> Point:
+    return fromJacobian(multiplySumJacobian(terms, window))
+
+
+# Joint table for Shamir's trick, T[i << window | j] = i * Q1 + j * Q2.
+def jointTable(Q1: Point, Q2: Point, window: int = 2) -> List[Jacobian]:
+    size: int = 1 << window
+    A1: Jacobian = toJacobian(Q1)
+    A2: Jacobian = toJacobian(Q2)
+
+    T: List[Jacobian] = [INFINITY] * (size * size)
+    for j in range(1, size):
+        T[j] = jacobianAdd(T[j - 1], A2)
+    for i in range(1, size):
+        for j in range(size):
+            T[i << window | j] = jacobianAdd(T[i - 1 << window | j], A1)
+    return T
+
+
+# Shamir's trick: find k1 * Q1 + k2 * Q2 over a single shared chain of doublings.
+# Both scalars are reduced mod N, then read 'window' bits at a time and looked up in 'jointTable'.
+def multiplyAddJacobian(
+    Q1: Point, k1: int, Q2: Point, k2: int,
+    window: int = 2, T: Optional[List[Jacobian]] = None
+) -> Jacobian:
+    k1 %= N
+    k2 %= N
+    if T is None:
+        T = jointTable(Q1, Q2, window)
+
+    mask: int = (1 << window) - 1
+    bits: int = max(k1.bit_length(), k2.bit_length())
+    S: Jacobian = INFINITY
+    for shift in range(-(-bits // window) * window - window, -1, -window):
+        for _ in range(window):
+            S = jacobianDouble(S)
+        i: int = (k1 >> shift & mask) << window | (k2 >> shift & mask)
+        if i: S = jacobianAdd(S, T[i])
+    return S
+
+
+def multiplyAdd(Q1: Point, k1: int, Q2: Point, k2: int, window: int = 2) -> Point:
+    return fromJacobian(multiplyAddJacobian(Q1, k1, Q2, k2, window))
+
+
+# Row 'i' holds the affine points j * 2^(window * i) * Q for j = 1 .. 2^window - 1.
+# The whole table is built in Jacobian coordinates and normalized with one inversion.
+def precompute(Q: Point, window: int = BASE_WINDOW) -> List[List[Point]]:
+    cols: int = (1 << window) - 1
+    Js: List[Jacobian] = []
+    B: Jacobian = toJacobian(Q)
+    for _ in range(-(-N.bit_length() // window)):
+        S: Jacobian = B
+        for _ in range(cols):
+            Js.append(S)
+            S = jacobianAdd(S, B)
+
+        for _ in range(window):
+            B = jacobianDouble(B)
+
+    points: List[Point] = fromJacobianMany(Js)
+    return [points[i: i + cols] for i in range(0, len(points), cols)]
+
+
+def baseTable() -> List[List[Point]]:
+    global BASE_TABLE
+    if BASE_TABLE is None:
+        BASE_TABLE = precompute(G, BASE_WINDOW)
+    return BASE_TABLE
+
+
+# Save the table of 'G' so other processes can skip building it.
+def saveBaseTable(path: str) -> None:
+    saveTable(baseTable(), path)
+
+
+# Check that 'table' is what 'precompute(G, window)' builds and return its window. Starting
+# from 'G', every entry must be the previous one plus the first of its row, and every row
+# must start 2^window times further along. The sums stay Jacobian and are compared without inverting.
+def checkBaseTable(table: List[List[Point]]) -> int:
+    cols: int = len(table[0]) if table else 0
+    window: int = (cols + 1).bit_length() - 1
+    if cols == 0 or cols + 1 != 1 << window or len(table) != -(-N.bit_length() // window):
+        raise ValueError('Table has the wrong shape.')
 
+    B: Jacobian = toJacobian(G)
+    for row in table:
+        if len(row) != cols:
+            raise ValueError('Table has the wrong shape.')
 
-def multiply(Q: Point, k: int) -> Point:
-    G: Point = Point(Q.x, Q.y)
-    S: Point = Point(0, 0)
+        S: Jacobian = B
+        for T in row:
+            X, Y, Z = S
+            ZZ: int = Z * Z % P
+            if Z == 0 or T.x >= P or T.y >= P or (X - T.x * ZZ) % P or (Y - T.y * ZZ * Z) % P:
+                raise ValueError('Table was not built from G.')
+            S = jacobianAdd(toJacobian(T), toJacobian(row[0]))
+
+        B = toJacobian(row[0])
+        for _ in range(window):
+            B = jacobianDouble(B)
+    return window
+
+
+def loadBaseTable(path: str) -> None:
+    global BASE_TABLE, BASE_WINDOW
+    table: List[List[Point]] = loadTable(path)
+    BASE_WINDOW = checkBaseTable(table)
+    BASE_TABLE = table
+
+
+# Multiply 'G' by 'k' using only table lookups and mixed additions.
+def baseMultiplyJacobian(k: int) -> Jacobian:
+    table: List[List[Point]] = baseTable()
+    mask: int = (1 << BASE_WINDOW) - 1
+    k %= N
+
+    S: Jacobian = INFINITY
+    i: int = 0
+    while k:
+        j: int = k & mask
+        if j:
+            T: Point = table[i][j - 1]
+            S = jacobianAdd(S, (T.x, T.y, 1))
+        k >>= BASE_WINDOW
+        i += 1
+    return S
+
+
+def baseMultiply(k: int) -> Point:
+    return fromJacobian(baseMultiplyJacobian(k))
+
+
+# Reference affine ladder, one inversion per step.
+def multiplyAffine(Q: Point, k: int) -> Point:
+    G: Point = Point(Q.x, Q.y, Q.infinity)
+    S: Point = Point.atInfinity()
     while k:
         if k & 1: add(S, G)
         double(G)
@@ -68,33 +396,198 @@ def multiply(Q: Point, k: int) -> Point:
     return S
 
 
+# Fixed-sequence multiply for secret scalars, see 'curve.ladder'. 'Q' enters at random
+# projective coordinates (λ²x, λ³y, λ) so no step takes the mixed-addition shortcut.
+def ladderMultiplyJacobian(Q: Point, k: int) -> Jacobian:
+    l: int = int.from_bytes(os.urandom(32), 'big') % (P - 1) + 1
+    ll: int = l * l % P
+    A: Jacobian = (Q.x * ll % P, Q.y * ll * l % P, l)
+    return ladder(GROUP, A, ladderScalar(k, N), N.bit_length() + 1)
+
+
+def ladderMultiply(Q: Point, k: int) -> Point:
+    return fromJacobian(ladderMultiplyJacobian(Q, k))
+
+
+def ladderBaseMultiply(k: int) -> Point:
+    return ladderMultiply(G, k)
+
+
+# How 'getPublicKey' and 'sign' multiply 'G' by secret scalars: 'table' looks up the
+# fixed-base table and skips zero windows, 'ladder' runs the same operations for every
+# key, for hosts where timing may leak. See 'useSecretMode'.
+SECRET_MODES: Dict[str, Callable[[int], Point]] = {'table': baseMultiply, 'ladder': ladderBaseMultiply}
+SECRET_MULTIPLY: Callable[[int], Point] = baseMultiply
+
+
+def useSecretMode(name: str) -> None:
+    global SECRET_MULTIPLY
+    SECRET_MULTIPLY = SECRET_MODES[name]
+
+
+# A parsed public key, optionally holding its 'jointTable' with 'G' for repeated verification.
+class PublicKey():
+    def __init__(self, point: Point) -> None:
+        self.point: Point = point
+        self.window: int = 2
+        self.table: Optional[List[Jacobian]] = None
+
+    # The table is normalized to Z = 1 so every lookup is a mixed addition.
+    def precompute(self, window: int = 2) -> None:
+        self.window = window
+        self.table = [
+            toJacobian(Q) for Q in fromJacobianMany(jointTable(G, self.point, window))
+        ]
+
+
+# Bounded least-recently-used cache of parsed public keys, keyed on their serialized form.
+class KeyCache():
+    def __init__(self, maxSize: int = 1024, precompute: bool = True) -> None:
+        self.maxSize: int = maxSize
+        self.precompute: bool = precompute
+        self.keys: OrderedDict = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, pk: Union[List[int], Buffer]) -> PublicKey:
+        key: bytes = bytes(pk)
+        publicKey: Optional[PublicKey] = self.keys.get(key)
+        if publicKey is not None:
+            self.hits += 1
+            self.keys.move_to_end(key)
+            return publicKey
+
+        self.misses += 1
+        publicKey = PublicKey(ArrToPoint(pk))
+        if self.precompute:
+            publicKey.precompute()
+
+        self.keys[key] = publicKey
+        self.resize(self.maxSize)
+        return publicKey
+
+    def resize(self, maxSize: int) -> None:
+        self.maxSize = maxSize
+        while len(self.keys) > maxSize:
+            self.keys.popitem(last=False)
+
+    def clear(self) -> None:
+        self.keys.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+KEY_CACHE: KeyCache = KeyCache()
+
+
+# None if 'pk' does not parse or is not a point on the curve, nothing is cached for it then.
+def parsePublicKey(pk: Union[List[int], Buffer, Point, PublicKey]) -> Optional[PublicKey]:
+    if isinstance(pk, PublicKey): return pk if isOnCurve(pk.point) else None
+    if isinstance(pk, Point): return PublicKey(pk) if isOnCurve(pk) else None
+    try:
+        return KEY_CACHE.get(pk)
+    except ValueError:
+        return None
+
+
 # Multiply Point 'G' by int 'secretKey' to find public key.
-def getPublicKey(sk: List[int], isCompressed: bool = False) -> List[int]:
+def getPublicKey(sk: Union[List[int], Buffer], isCompressed: bool = False) -> Union[List[int], bytes]:
     secretKey: int = mod(bytesToNum(sk), P)
-    PK: Point = multiply(G, secretKey)
-    return PK.toArray(isCompressed)
+    PK: Point = SECRET_MULTIPLY(secretKey)
+    pk: List[int] = PK.toArray(isCompressed)
+    return bytes(pk) if isBuffer(sk) else pk
 
 
-# Sign message using secret key.
-def sign(msg: List[int], sk: List[int], entropy: List[int]) -> List[int]:
-    message: int = bytesToNum(msg)
-    secretKey: int = bytesToNum(sk)
+# HMAC-SHA256 of 'data' under the already keyed 'key', which is copied rather than rekeyed.
+def mac(key: Union[Hmac256, hmac.HMAC], data: bytes) -> bytes:
+    h: Union[Hmac256, hmac.HMAC] = key.copy()
+    h.update(data)
+    return h.digest()
+
+
+# Candidate nonces for 'secretKey' and the message hash 'message', RFC 6979 3.2 with
+# HMAC-SHA256. 'extra' is the optional additional data k' of section 3.6. Each K is keyed
+# once by 'hmac256Key' and every HMAC under it copies that state.
+def nonces(secretKey: int, message: int, extra: bytes = b'') -> Iterator[int]:
+    seed: bytes = secretKey.to_bytes(32, 'big') + (message % N).to_bytes(32, 'big') + extra
+    V: bytes = b'\x01' * 32
+    K: Union[Hmac256, hmac.HMAC] = hmac256Key(b'\x00' * 32)
+
+    K = hmac256Key(mac(K, V + b'\x00' + seed))
+    V = mac(K, V)
+    K = hmac256Key(mac(K, V + b'\x01' + seed))
+    V = mac(K, V)
+
+    while True:
+        V = mac(K, V)
+        k: int = int.from_bytes(V, 'big')
+        if 0 < k < N:
+            yield k
+
+        # Out of range or rejected by the signer, step the generator.
+        K = hmac256Key(mac(K, V + b'\x00'))
+        V = mac(K, V)
+
+
+# Sign the hash 'message' with 'secretKey', drawing nonces until both halves are nonzero.
+# Also returns the recovery id, the parity of 'R.y' plus 2 when 'R.x' was reduced mod N.
+def signNumber(message: int, secretKey: int, extra: bytes = b'') -> Tuple[int, int, int]:
+    for k in nonces(secretKey, message, extra):
+        R: Point = SECRET_MULTIPLY(k)
+        r: int = R.x % N
+        s: int = (message + r * secretKey) * invert(k, N) % N
+        if r and s:
+            return r, s, (R.y & 1) | (R.x >= N) << 1
 
-    r: int = 0
-    s: int = 0
-    while r == 0 or s == 0:
-        entropy: List[int] = hmac256(msg, entropy)
-        seed: int = bytesToNum(entropy)
-        r = multiply(G, seed).x
-        s = ((message + r * secretKey) * invert(seed, N)) % N
 
-    return numToBytes(r, 32) + numToBytes(s, 32)
+# 'r || s', followed by the recovery id byte when 'recid' is given.
+def encodeSignature(r: int, s: int, recid: Optional[int], asBytes: bool) -> Union[List[int], bytes]:
+    sig: bytes = r.to_bytes(32, 'big') + s.to_bytes(32, 'big')
+    if recid is not None:
+        sig += bytes([recid])
+    return sig if asBytes else list(sig)
+
+
+# Sign message using secret key. Nonces are deterministic (RFC 6979), any 'entropy' is
+# mixed in as additional data so signatures differ per call yet never repeat a nonce.
+# 'recoverable' appends the recovery id for 'recover' as a 65th byte.
+def sign(
+    msg: Union[List[int], Buffer],
+    sk: Union[List[int], Buffer],
+    entropy: Optional[Union[List[int], Buffer]] = None,
+    recoverable: bool = False
+) -> Union[List[int], bytes]:
+    r, s, recid = signNumber(bytesToNum(msg), bytesToNum(sk), bytes(entropy or b''))
+    return encodeSignature(r, s, recid if recoverable else None, isBuffer(msg))
+
+
+# Sign every message in 'msgs' with one key, parsed once, against the fixed-base table.
+def signMany(
+    msgs: Iterable[Union[List[int], Buffer]],
+    sk: Union[List[int], Buffer],
+    entropy: Optional[Union[List[int], Buffer]] = None,
+    recoverable: bool = False
+) -> List[Union[List[int], bytes]]:
+    secretKey: int = bytesToNum(sk)
+    extra: bytes = bytes(entropy or b'')
+    baseTable()
+
+    sigs: List[Union[List[int], bytes]] = []
+    for msg in msgs:
+        r, s, recid = signNumber(bytesToNum(msg), secretKey, extra)
+        sigs.append(encodeSignature(r, s, recid if recoverable else None, isBuffer(msg)))
+    return sigs
 
 
 # Verify signature is valid using public key.
-def verify(sig: List[int], msg: List[int], pk: List[int]) -> bool:
+def verify(
+    sig: Union[List[int], Buffer],
+    msg: Union[List[int], Buffer],
+    pk: Union[List[int], Buffer, Point, PublicKey]
+) -> bool:
     message: int = bytesToNum(msg)
-    publicKey: int = ArrToPoint(pk)
+    publicKey: Optional[PublicKey] = parsePublicKey(pk)
+    if publicKey is None: return False
 
     r: int = bytesToNum(sig[:32])
     s: int = bytesToNum(sig[32:])
@@ -103,12 +596,115 @@ def verify(sig: List[int], msg: List[int], pk: List[int]) -> bool:
     if message == 0: return False
 
     inv_s: int = invert(s, N)
-    Q: Point = multiply(G, (message * inv_s) % N)
-    R: Point = multiply(publicKey, (r * inv_s) % N)
+    u1: int = (message * inv_s) % N
+    u2: int = (r * inv_s) % N
+    if publicKey.table is None:
+        Q: Point = multiplyAdd(G, u1, publicKey.point, u2)
+    else:
+        Q: Point = fromJacobian(multiplyAddJacobian(G, u1, publicKey.point, u2, publicKey.window, publicKey.table))
+    return not Q.infinity and mod(Q.x, N) == r
+
+
+# The nonce point 'R' of a signature from 'r' and the recovery id, None if there is none
+# or 'recid' is not one of 0 .. 3.
+def recoverR(r: int, recid: int) -> Optional[Point]:
+    if recid not in (0, 1, 2, 3): return None
+    x: int = r + N if recid & 2 else r
+    if x >= P: return None
+    return liftX(x, recid & 1)
+
+
+# Public key that produced 'sig' over 'msg', found as r⁻¹(sR - eG). The 'G' half comes
+# from the fixed-base table, which beats Shamir's trick once the table exists.
+# Serialized like 'getPublicKey', None if the signature matches no key.
+def recover(
+    sig: Union[List[int], Buffer],
+    recid: int,
+    msg: Union[List[int], Buffer],
+    isCompressed: bool = False
+) -> Optional[Union[List[int], bytes]]:
+    return recoverMany([(sig, recid, msg)], isCompressed)[0]
+
+
+# 'recover' for many '(sig, recid, msg)' triples: the 'r' inverses and the final
+# conversions to affine each share a single inversion across the batch.
+def recoverMany(
+    items: Iterable[Tuple[Union[List[int], Buffer], int, Union[List[int], Buffer]]],
+    isCompressed: bool = False
+) -> List[Optional[Union[List[int], bytes]]]:
+    items = list(items)
+    rs: List[int] = [bytesToNum(sig[:32]) for sig, _, _ in items]
+    inverses: List[int] = batchInvert(rs, N)
+
+    Js: List[Jacobian] = []
+    for (sig, recid, msg), r, z in zip(items, rs, inverses):
+        s: int = bytesToNum(sig[32:64])
+        R: Optional[Point] = recoverR(r, recid) if 0 < r < N and 0 < s < N else None
+        if R is None:
+            Js.append(INFINITY)
+            continue
+        Js.append(jacobianAdd(multiplyJacobian(R, s * z % N), baseMultiplyJacobian(-bytesToNum(msg) * z % N)))
+
+    keys: List[Optional[Union[List[int], bytes]]] = []
+    for Q, (_, _, msg) in zip(fromJacobianMany(Js), items):
+        if Q.infinity:
+            keys.append(None)
+            continue
+        pk: List[int] = Q.toArray(isCompressed)
+        keys.append(bytes(pk) if isBuffer(msg) else pk)
+    return keys
+
+
+# 'verify' for untrusted input, a malformed triple is simply not valid.
+def verifyItem(sig: Buffer, msg: Buffer, pk: Buffer) -> bool:
+    try:
+        return verify(sig, msg, pk)
+    except (ValueError, TypeError, IndexError):
+        return False
+
+
+# Verify a list of '(sig, msg, pk)' triples, keys are parsed through the worker's 'KEY_CACHE'.
+# One bad item yields False for itself and never ends the chunk.
+def verifyChunk(items: List[Tuple[Buffer, Buffer, Buffer]]) -> List[bool]:
+    return [verifyItem(*item) for item in items]
+
+
+# Verify '(sig, msg, pk)' triples across 'processes' workers, yielding one result per item in order.
+# 'items' is consumed 'chunkSize' triples at a time with only a few chunks in flight, so it may be
+# an arbitrarily long iterator. 'report' receives the running count and items per second.
+def verifyBatch(
+    items: Iterable[Tuple[Buffer, Buffer, Buffer]],
+    chunkSize: int = 1024,
+    processes: Optional[int] = None,
+    report: Optional[Callable[[int, float], None]] = None
+) -> Iterator[bool]:
+    it: Iterator[Tuple[Buffer, Buffer, Buffer]] = iter(items)
+    chunks: Iterator[List[Tuple[Buffer, Buffer, Buffer]]] = iter(lambda: list(islice(it, chunkSize)), [])
+    processes = processes or cpu_count()
+
+    start: float = perf_counter()
+    count: int = 0
+
+    def collect(results: List[bool]) -> List[bool]:
+        nonlocal count
+        count += len(results)
+        if report: report(count, count / max(perf_counter() - start, 1e-9))
+        return results
+
+    if processes == 1:
+        for chunk in chunks:
+            yield from collect(verifyChunk(chunk))
+        return
+
+    with Pool(processes) as pool:
+        pending: Deque = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(verifyChunk, (chunk,)))
+            if len(pending) >= 2 * processes:
+                yield from collect(pending.popleft().get())
+        while pending:
+            yield from collect(pending.popleft().get())
 
-    add(Q, R)
-    return mod(Q.x, N) == r
-    
 
 if __name__ == '__main__':
     """
@@ -126,9 +722,25 @@ if __name__ == '__main__':
         163, 51, 33, 249, 142, 79, 241, 194, 131, 199, 105, 152, 241, 79, 87, 68,
         117, 69, 211, 57, 179, 219, 83, 76, 109, 136, 109, 236, 180, 32, 159, 40
     ]
-    entropy: List[int] = numToBytes(randint(0, P))
-    sig: List[int] = sign(msg, sk, entropy)
+    sig: List[int] = sign(msg, sk)
     print('Signature:', sig)
 
     isValid: bool = verify(sig, msg, pk)
-    print('Valid:', isValid)
\ No newline at end of file
+    print('Valid:', isValid)
+
+    # A batch mixing good items, a key that is off the curve and a truncated key.
+    item: Tuple[bytes, bytes, bytes] = (bytes(sig), bytes(msg), bytes(pk))
+    items: List[Tuple[bytes, bytes, bytes]] = [item] * 6 + [
+        (bytes(sig), bytes(msg), b'\x02' + (5).to_bytes(32, 'big')),
+        (bytes(sig), bytes(msg), bytes(pk[:20]))
+    ]
+    print('Batch:', list(verifyBatch(items, chunkSize=4)))
+
+    # Compare the Jacobian and affine ladders.
+    from timeit import timeit
+    k: int = bytesToNum(sk)
+    baseTable()
+    print('Fixed-base multiply:', timeit(lambda: baseMultiply(k), number=20) / 20)
+    for width in range(2, 7):
+        print(f'Jacobian wNAF multiply, width {width}:', timeit(lambda: multiply(G, k, width), number=20) / 20)
+    print('Affine multiply:', timeit(lambda: multiplyAffine(G, k), number=20) / 20)
\ No newline at end of file
@@ -1,17 +1,32 @@
-from util import joinBytes, splitBits
-from typing import List
+from util import Buffer, isBuffer, joinBytes, splitBits
+from backend import register, get
+from typing import Callable, List, Optional, Union
+from struct import Struct
+import hashlib
+import mmap
+import os
 
 
 BIT_MASK: int = (1 << 32) - 1
 
+# Sixteen big-endian words, parsed straight out of a 64 byte block.
+BLOCK: Struct = Struct('>16I')
+
+# Bytes handed to 'update' per step in 'sha1File', a whole number of blocks.
+FILE_STEP: int = 64 * 16384
+
 
 # The first 32 bits of the fractional parts of the cube roots of the first 4 primes.
 K: List[int] = [0x5a827999, 0x6ed9eba1, 0x8f1bbcdc, 0xca62c1d6]
 
 
-def shaPad(message: List[int], byteSize: int) -> List[int]:
+# The first 32 bits of the fractional parts of the square roots of the first 5 primes.
+IV: List[int] = [0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476, 0xc3d2e1f0]
+
+
+def shaPad(message: List[int], byteSize: int, length: Optional[int] = None) -> List[int]:
     bitSize: int = byteSize * 8
-    outLength: int = (len(message) // bitSize + 1) * bitSize
+    outLength: int = (len(message) + byteSize) // bitSize * bitSize + bitSize
     out: List[int] = [0] * outLength
 
     # Copy first 'n' values of 'message' to 'out'.
@@ -24,7 +39,7 @@ def shaPad(message: List[int], byteSize: int) -> List[int]:
     out[i] = 0x80
 
     byteMask: int = (1 << 8) - 1
-    inLength: int = len(message) * 8
+    inLength: int = (len(message) if length is None else length) * 8
 
     # Append a 'message' length to the end of 'out' in bits.
     i: int = len(out)
@@ -101,41 +116,154 @@ def update(out: List[int], msg: List[int], start: int) -> None:
         out[i] = (out[i] + H[i]) & BIT_MASK
 
 
-def sha1(message: List[int]) -> List[int]:
-    # The first 32 bits of the fractional parts of the square roots of the first 5 primes.
-    H: List[int] = [0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476, 0xc3d2e1f0]
+class Sha1():
+    name: str = 'sha1'
+    digest_size: int = 20
+    block_size: int = 64
+
+    def __init__(self, message: Optional[Union[List[int], Buffer]] = None) -> None:
+        self.h: List[int] = IV[:]
+        self.buffer: bytearray = bytearray()    # Holds at most one partial block.
+        self.length: int = 0
+        if message is not None:
+            self.update(message)
+
+    def update(self, message: Union[List[int], Buffer]) -> None:
+        if not isBuffer(message):
+            message = bytes(message)    # Compatibility path for 'List[int]' input.
+        view: memoryview = memoryview(message).cast('B')
+        self.length += len(view)
+
+        # Top up a partially filled block first.
+        i: int = 0
+        if self.buffer:
+            i = 64 - len(self.buffer)
+            self.buffer += view[:i]
+            if len(self.buffer) < 64:
+                return
+            update(self.h, BLOCK.unpack_from(self.buffer), 0)
+
+        # Parse each 64 byte interval of 'message' in place to update 'h'.
+        while i + 64 <= len(view):
+            update(self.h, BLOCK.unpack_from(view, i), 0)
+            i += 64
+
+        self.buffer = bytearray(view[i:])
+
+    def digest(self) -> bytes:
+        H: List[int] = self.h[:]
+
+        padding: List[int] = shaPad(self.buffer, 8, self.length)  # Pad the final partial block.
+        payload: List[int] = joinBytes(padding, 4)                # Convert byte array to 32-bit array.
+        for i in range(0, len(payload), 16):
+            update(H, payload, i)
+
+        # Convert 32-bit array to byte array.
+        return bytes(splitBits(H, 4))
+
+    def hexdigest(self) -> str:
+        return self.digest().hex()
+
+    def copy(self) -> 'Sha1':
+        other: Sha1 = Sha1.__new__(Sha1)
+        other.h = self.h[:]
+        other.buffer = self.buffer[:]
+        other.length = self.length
+        return other
+
+
+def sha1Python(message: Union[List[int], Buffer]) -> Union[List[int], bytes]:
+    hashed: bytes = Sha1(message).digest()
+    return hashed if isBuffer(message) else list(hashed)
+
+
+def sha1Hashlib(message: Union[List[int], Buffer]) -> Union[List[int], bytes]:
+    hashed: bytes = hashlib.sha1(message if isBuffer(message) else bytes(message)).digest()
+    return hashed if isBuffer(message) else list(hashed)
+
+
+# Dispatch to the fastest backend that agrees with 'sha1Python', see 'backend'.
+def sha1(message: Union[List[int], Buffer]) -> Union[List[int], bytes]:
+    return get('sha1')(message)
+
+
+register('sha1', 'python', sha1Python, [(b'',), (bytes(range(200)),), ([97, 98, 99],)])
+register('sha1', 'hashlib', sha1Hashlib)
+
+
+# Hash the file at 'path' through a read-only memory map. Whole blocks are parsed in place,
+# only the last partial block is copied before padding, so memory use doesn't grow with
+# the file. 'progress' receives the bytes hashed so far and the file size.
+def sha1File(path: str, progress: Optional[Callable[[int, int], None]] = None) -> bytes:
+    h: Sha1 = Sha1()
+    with open(path, 'rb') as f:
+        size: int = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return h.digest()   # Empty files can't be mapped.
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            view: memoryview = memoryview(data)
+            try:
+                for start in range(0, size, FILE_STEP):
+                    h.update(view[start: start + FILE_STEP])
+                    if progress:
+                        progress(min(start + FILE_STEP, size), size)
+            finally:
+                view.release()
+
+    return h.digest()
+
+
+# HMAC keyed once: the inner and outer hashes absorb the padded key up front and 'copy'
+# reuses those midstates, so each message costs no key setup.
+class Hmac1():
+    name: str = 'hmac-sha1'
+    digest_size: int = 20
+    block_size: int = 64
+
+    def __init__(self, key: Union[List[int], Buffer], message: Optional[Union[List[int], Buffer]] = None) -> None:
+        if len(key) > 64:
+            key = sha1(key)
+
+        # Ensure 'key' length is evenly divisible by 64.
+        padded: List[int] = [0] * 64
+        for i in range(len(key)):
+            padded[i] = key[i]
 
-    padding: List[int] = shaPad(message, 8)     # Ensure 'message' length is evenly divisible by 64.
-    payload: List[int] = joinBytes(padding, 4)  # Convert byte array to 32-bit array.
+        # Xor each bit value of 'padded' and 0x36.
+        for i in range(len(padded)):
+            padded[i] ^= 0x36
+        self.inner: Sha1 = Sha1(padded)
 
-    # Use each 32 bit interval of 'message' to update 'H'.
-    for i in range(0, len(payload), 16):
-        update(H, payload, i)
+        # Xor each bit value of 'padded' and 0x6a.
+        for i in range(len(padded)):
+            padded[i] ^= 0x6a
+        self.outer: Sha1 = Sha1(padded)
 
-    # Convert 32-bit array to byte array.
-    return splitBits(H, 4)
+        if message is not None:
+            self.update(message)
 
+    def update(self, message: Union[List[int], Buffer]) -> None:
+        self.inner.update(message)
 
-def hmac1(key: List[int], message: List[int]) -> List[int]:
-    if len(key) > 64:
-        key = sha1(key)
+    def digest(self) -> bytes:
+        outer: Sha1 = self.outer.copy()
+        outer.update(self.inner.digest())
+        return outer.digest()
 
-    # Ensure 'key' length is evenly divisible by 64.
-    padded: List[int] = [0] * 64
-    for i in range(len(key)):
-        padded[i] = key[i]
+    def hexdigest(self) -> str:
+        return self.digest().hex()
 
-    # Xor each bit value of 'padded' and 0x36.
-    for i in range(len(padded)):
-        padded[i] ^= 0x36
-    inner = padded + message
+    def copy(self) -> 'Hmac1':
+        other: Hmac1 = Hmac1.__new__(Hmac1)
+        other.inner = self.inner.copy()
+        other.outer = self.outer    # Never updated in place, safe to share.
+        return other
 
-    # Xor each bit value of 'padded' and 0x6a.
-    for i in range(len(padded)):
-        padded[i] ^= 0x6a
-    outer = padded + sha1(inner)
 
-    return sha1(outer)
+def hmac1(key: Union[List[int], Buffer], message: Union[List[int], Buffer]) -> Union[List[int], bytes]:
+    hashed: bytes = Hmac1(key, message).digest()
+    return hashed if isBuffer(message) else list(hashed)
 
 
 if __name__ == '__main__':
@@ -1,8 +1,19 @@
-from typing import List
+from typing import List, Union
+
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+# Check whether 'arr' can be read through the buffer protocol.
+def isBuffer(arr: Union[List[int], Buffer]) -> bool:
+    return isinstance(arr, (bytes, bytearray, memoryview))
 
 
 # Convert number array to large int.
-def bytesToNum(arr: List[int], endian='be') -> int:
+def bytesToNum(arr: Union[List[int], Buffer], endian='be') -> int:
+    if isBuffer(arr):
+        return int.from_bytes(arr, 'big' if endian == 'be' else 'little')
+
     n: int = 0
 
     if endian == 'be':